@@ -2,6 +2,8 @@
 TwitchTV, Notify and config reading abstractions for TwitchNotifier
 '''
 import configparser
+import collections
+import threading
 import time
 import re
 import sys
@@ -17,6 +19,12 @@ HEAD = {'Accept': 'application/vnd.twitchtv.v5+json',
         'Client-ID': CLIENT_ID}
 LIMIT = 100
 SECTION = 'messages'
+QUEUE_SIZE = 32
+RETRIES = 3
+RETRY_DELAY = 1
+SHOW_TIMEOUT = 10
+STOP_TIMEOUT = 5
+MERGE_LIMIT = 10
 
 
 class Settings(object):
@@ -111,6 +119,281 @@ class Settings(object):
                                       raw=True)
 
 
+class NotifyBackend(object):
+    '''
+    Base class for the things that actually show notifications to the user
+    '''
+    def show(self, title, message):
+        '''
+        Show a notification
+
+        Positional arguments:
+        title - notification title
+        message - notification message
+
+        Raises:
+        RuntimeError - failed to show the notification
+        '''
+        raise NotImplementedError
+
+    def idle(self):
+        '''Called when there are no more pending notifications'''
+
+    def close(self):
+        '''Release everything the backend holds'''
+
+
+class LibnotifyBackend(NotifyBackend):
+    '''
+    Shows notifications using libnotify/gobject
+    '''
+    def show(self, title, message):
+        show_notification(title, message)
+
+    def idle(self):
+        Notify.uninit()
+
+    def close(self):
+        Notify.uninit()
+
+
+class NullBackend(NotifyBackend):
+    '''
+    Silently discards all notifications
+    '''
+    def show(self, title, message):
+        pass
+
+
+class MemoryBackend(NotifyBackend):
+    '''
+    Saves all notifications in self.shown as (title, message) tuples
+    '''
+    def __init__(self):
+        self.shown = []
+
+    def show(self, title, message):
+        self.shown.append((title, message))
+
+
+class DispatchOptions(object):
+    '''
+    Tuning of a Dispatcher
+    '''
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, maxsize=QUEUE_SIZE, policy='merge', retries=RETRIES,
+                 retry_delay=RETRY_DELAY, timeout=SHOW_TIMEOUT,
+                 merge_limit=MERGE_LIMIT):
+        '''
+        Keyword arguments:
+        maxsize - maximum number of pending notifications
+        policy - what to do when the queue is full: 'drop' discards the new
+        notification, 'merge' folds it into the newest pending one
+        retries - how many times to retry a failed notification
+        retry_delay - seconds to wait between retries
+        timeout - seconds after which showing a notification counts as failed
+        merge_limit - maximum number of notifications folded into one,
+        further ones are dropped
+        '''
+        self.maxsize = maxsize
+        self.policy = policy
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.merge_limit = merge_limit
+
+
+# The queue state has to be shared between the poller and the worker thread
+class Dispatcher(object):  # pylint: disable=too-many-instance-attributes
+    '''
+    Shows notifications from a bounded queue in a separate worker thread so
+    that a slow or hung notification daemon does not stall the polling
+    '''
+    policies = ('drop', 'merge')
+
+    def __init__(self, backend=None, opts=None):
+        '''
+        Initialize the dispatcher. The worker thread is started on the first
+        call to self.submit()
+
+        Positional arguments:
+        backend - a NotifyBackend object, LibnotifyBackend if None
+        opts - a DispatchOptions object, defaults if None
+
+        Raises:
+        ValueError - invalid options
+        '''
+        opts = DispatchOptions() if opts is None else opts
+        if opts.maxsize < 1:
+            raise ValueError(f'Invalid queue size {opts.maxsize}')
+        if opts.policy not in self.policies:
+            raise ValueError(f'Invalid queue policy {opts.policy}')
+        if opts.merge_limit < 1:
+            raise ValueError(f'Invalid merge limit {opts.merge_limit}')
+
+        self.backend = LibnotifyBackend() if backend is None else backend
+        self.opts = opts
+        self.dropped = 0
+        self.pending = collections.deque()
+        self.cond = threading.Condition()
+        self.busy = False
+        self.stopped = False
+        self.thread = None
+
+    def submit(self, title, message):
+        '''
+        Queue a notification without blocking. Notifications that do not fit
+        into the queue or arrive after self.stop() are counted in self.dropped
+
+        Positional arguments:
+        title - notification title
+        message - notification message
+
+        Returns False if the notification was dropped, True otherwise
+        '''
+        with self.cond:
+            if self.stopped:
+                self.dropped += 1
+                return False
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name='TwitchNotifier-dispatch',
+                                               daemon=True)
+                self.thread.start()
+
+            if len(self.pending) >= self.opts.maxsize:
+                if (self.opts.policy == 'drop' or
+                        len(self.pending[-1]) >= self.opts.merge_limit):
+                    self.dropped += 1
+                    return False
+                self.pending[-1].append((title, message))
+            else:
+                self.pending.append([(title, message)])
+            self.cond.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        '''
+        Wait until all pending notifications are shown
+
+        Positional arguments:
+        timeout - maximum number of seconds to wait, forever if None
+
+        Returns True if everything was shown, False if timed out
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and
+                                      not self.busy, timeout)
+
+    def stop(self, timeout=None):
+        '''
+        Stop the worker thread after it shows the pending notifications
+
+        Positional arguments:
+        timeout - maximum number of seconds to wait for the worker, forever
+        if None. The worker is a daemon thread so if it does not finish in
+        time the remaining notifications are lost and the backend is not
+        closed
+        '''
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return
+        self.backend.close()
+
+    def run(self):
+        '''
+        Main loop of the worker thread
+        '''
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or self.stopped)
+                if not self.pending:
+                    return
+                title, message = merge(self.pending.popleft())
+                self.busy = True
+
+            try:
+                self.show(title, message)
+                self.idle()
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+    def show(self, title, message):
+        '''
+        Show a notification with the backend, retrying self.opts.retries times
+
+        Positional arguments:
+        title - notification title
+        message - notification message
+        '''
+        error = None
+        for attempt in range(self.opts.retries + 1):
+            try:
+                self.call(title, message)
+                return
+            # GLib.Error and friends must not kill the worker thread
+            except Exception as ex:  # pylint: disable=broad-except
+                error = ex
+                if attempt < self.opts.retries:
+                    time.sleep(self.opts.retry_delay)
+
+        print(f'Failed to show a notification: {error}', file=sys.stderr)
+        print('Title: ' + title, file=sys.stderr)
+        print('Message: ' + message, file=sys.stderr)
+
+    def call(self, title, message):
+        '''
+        Call self.backend.show() in a separate thread and give up on it after
+        self.opts.timeout seconds. A hung call is left behind in its daemon
+        thread so that the worker can go on
+
+        Positional arguments:
+        title - notification title
+        message - notification message
+
+        Raises:
+        RuntimeError - the backend did not respond in time
+        Whatever self.backend.show() raises
+        '''
+        result = []
+
+        def target():
+            try:
+                self.backend.show(title, message)
+                result.append(None)
+            except Exception as ex:  # pylint: disable=broad-except
+                result.append(ex)
+
+        thread = threading.Thread(target=target, name='TwitchNotifier-show',
+                                  daemon=True)
+        thread.start()
+        thread.join(self.opts.timeout)
+        if not result:
+            raise RuntimeError('Notification backend did not respond in '
+                               f'{self.opts.timeout} seconds')
+        if result[0] is not None:
+            raise result[0]
+
+    def idle(self):
+        '''
+        Let the backend know if there are no more pending notifications
+        '''
+        with self.cond:
+            if self.pending:
+                return
+        try:
+            self.backend.idle()
+        except Exception as ex:  # pylint: disable=broad-except
+            print(f'Notification backend failed to go idle: {ex}',
+                  file=sys.stderr)
+
+
 class NotifyApi(object):
     '''
     A wrapper around calls to the TTV API
@@ -118,9 +401,10 @@ class NotifyApi(object):
     userid = ''
     verbose = False
     fhand = None
+    dispatcher = None
     statuses = {}
 
-    def __init__(self, nick, fmt, logfile, verbose=False):
+    def __init__(self, nick, fmt, logfile, verbose=False, backend=None):
         '''
         Initialize the API with various options
 
@@ -129,10 +413,12 @@ class NotifyApi(object):
         fmt - a Settings object
         logfile - location of the log file
         verbose - if we should be verbose in output
+        backend - a NotifyBackend object, LibnotifyBackend if None
         '''
         self.my_userid = '' if nick == '' else self.get_userid(nick.lower())
         self.verbose = verbose
         self.fmt = fmt
+        self.dispatcher = Dispatcher(backend)
         if logfile is not None:
             self.fhand = open(logfile, 'a')
 
@@ -170,7 +456,9 @@ class NotifyApi(object):
 
     def __del__(self):
         '''Clean up everything'''
-        Notify.uninit()
+        if self.dispatcher is not None:
+            # Pending notifications are lost if they do not make it in time
+            self.dispatcher.stop(STOP_TIMEOUT)
         if self.fhand is not None:
             self.fhand.close()
 
@@ -360,13 +648,11 @@ class NotifyApi(object):
             message = repl(data[1], name, self.fmt.notification_cont['off'])
             self.log(data[1], name, self.fmt.log_fmt['off'])
 
-        try:
-            show_notification(title, message)
-        except RuntimeError:
-            print('Failed to show a notification:',
+        if not self.dispatcher.submit(title, message):
+            reason = 'stopped' if self.dispatcher.stopped else 'full'
+            print(f'Notification queue is {reason}, dropped: {title} '
+                  f'({self.dispatcher.dropped} dropped so far)',
                   file=sys.stderr)
-            print('Title: ' + title, file=sys.stderr)
-            print('Message: ' + message, file=sys.stderr)
 
     def diff(self, new):
         '''
@@ -394,8 +680,6 @@ class NotifyApi(object):
 
             self.statuses[name] = ison
 
-        Notify.uninit()
-
     def log(self, stream, chan, msg):
         '''
         Write formatted msg to self.fl if it's open
@@ -456,6 +740,23 @@ def repl(stream, chan, msg):
     return ret
 
 
+def merge(notifs):
+    '''
+    Fold notifications into one
+
+    Positional arguments:
+    notifs - list of (title, message) tuples
+
+    Returns a (title, message) tuple. The title joins all titles and the
+    message holds every title followed by its message
+    '''
+    if len(notifs) == 1:
+        return notifs[0]
+    title = ', '.join(n[0] for n in notifs)
+    message = '\n\n'.join(n[0] + '\n' + n[1] for n in notifs)
+    return (title, message)
+
+
 def show_notification(title, message):
     '''
     Show a notification using libnotify/gobject
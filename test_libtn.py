@@ -1,4 +1,8 @@
+import contextlib
+import io
+import threading
 import unittest
+import unittest.mock
 import libtn
 
 class LibTest(unittest.TestCase):
@@ -168,5 +172,148 @@ class LibTest(unittest.TestCase):
         ret = libtn.repl(stream, chan, '$3$4$7')
         self.assertEqual(ret, 'test' + '123' + '24.2')
 
+    def test_dispatcher(self):
+        backend = libtn.MemoryBackend()
+        dispatcher = libtn.Dispatcher(backend)
+        self.assertEqual(dispatcher.submit('foo', 'is online'), True)
+        self.assertEqual(dispatcher.flush(5), True)
+        self.assertEqual(backend.shown, [('foo', 'is online')])
+        dispatcher.stop(5)
+        self.assertEqual(dispatcher.submit('foo', 'is offline'), False)
+        self.assertEqual(dispatcher.dropped, 1)
+
+        self.assertRaises(ValueError, libtn.Dispatcher, backend,
+                          libtn.DispatchOptions(maxsize=0))
+        self.assertRaises(ValueError, libtn.Dispatcher, backend,
+                          libtn.DispatchOptions(policy='foo'))
+        self.assertRaises(ValueError, libtn.Dispatcher, backend,
+                          libtn.DispatchOptions(merge_limit=0))
+
+    def test_dispatcher_full(self):
+        class SlowBackend(libtn.MemoryBackend):
+            def __init__(self):
+                super().__init__()
+                self.started = threading.Event()
+                self.event = threading.Event()
+
+            def show(self, title, message):
+                self.started.set()
+                self.event.wait(5)
+                super().show(title, message)
+
+        backend = SlowBackend()
+        opts = libtn.DispatchOptions(maxsize=1, policy='drop')
+        dispatcher = libtn.Dispatcher(backend, opts)
+        dispatcher.submit('a', 'is online')
+        self.assertEqual(backend.started.wait(5), True)
+        self.assertEqual(dispatcher.submit('b', 'is online'), True)
+        self.assertEqual(dispatcher.submit('c', 'is online'), False)
+        self.assertEqual(dispatcher.dropped, 1)
+        backend.event.set()
+        dispatcher.stop(5)
+        self.assertEqual(backend.shown, [('a', 'is online'),
+                                         ('b', 'is online')])
+
+        backend = SlowBackend()
+        opts = libtn.DispatchOptions(maxsize=1, merge_limit=2)
+        dispatcher = libtn.Dispatcher(backend, opts)
+        dispatcher.submit('a', 'is online')
+        self.assertEqual(backend.started.wait(5), True)
+        dispatcher.submit('TwitchNotifier', 'is online')
+        self.assertEqual(dispatcher.submit('c', 'is offline'), True)
+        self.assertEqual(dispatcher.submit('d', 'is offline'), False)
+        self.assertEqual(dispatcher.dropped, 1)
+        backend.event.set()
+        dispatcher.stop(5)
+        self.assertEqual(backend.shown, [('a', 'is online'),
+                                         ('TwitchNotifier, c',
+                                          'TwitchNotifier\nis online\n\n'
+                                          'c\nis offline')])
+
+    def test_dispatcher_retry(self):
+        class FlakyBackend(libtn.MemoryBackend):
+            failures = 2
+
+            def show(self, title, message):
+                if self.failures > 0:
+                    self.failures -= 1
+                    raise RuntimeError('Failed to show a notification')
+                super().show(title, message)
+
+        backend = FlakyBackend()
+        opts = libtn.DispatchOptions(retries=2, retry_delay=0)
+        dispatcher = libtn.Dispatcher(backend, opts)
+        dispatcher.submit('foo', 'is online')
+        dispatcher.stop(5)
+        self.assertEqual(backend.shown, [('foo', 'is online')])
+
+    def test_dispatcher_error(self):
+        class BrokenBackend(libtn.MemoryBackend):
+            broken = True
+
+            def show(self, title, message):
+                if self.broken:
+                    raise OSError('D-Bus is gone')
+                super().show(title, message)
+
+        backend = BrokenBackend()
+        opts = libtn.DispatchOptions(retries=0)
+        dispatcher = libtn.Dispatcher(backend, opts)
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            dispatcher.submit('foo', 'is online')
+            self.assertEqual(dispatcher.flush(5), True)
+        self.assertIn('D-Bus is gone', err.getvalue())
+
+        backend.broken = False
+        dispatcher.submit('bar', 'is online')
+        self.assertEqual(dispatcher.flush(5), True)
+        dispatcher.stop(5)
+        self.assertEqual(backend.shown, [('bar', 'is online')])
+
+    def test_dispatcher_timeout(self):
+        class HungBackend(libtn.MemoryBackend):
+            def __init__(self):
+                super().__init__()
+                self.event = threading.Event()
+
+            def show(self, title, message):
+                if title == 'hung':
+                    self.event.wait(5)
+                super().show(title, message)
+
+        backend = HungBackend()
+        opts = libtn.DispatchOptions(retries=0, timeout=0.1)
+        dispatcher = libtn.Dispatcher(backend, opts)
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            dispatcher.submit('hung', 'is online')
+            dispatcher.submit('foo', 'is online')
+            self.assertEqual(dispatcher.flush(5), True)
+        self.assertIn('did not respond', err.getvalue())
+        self.assertEqual(backend.shown, [('foo', 'is online')])
+        backend.event.set()
+        dispatcher.stop(5)
+
+    def test_merge(self):
+        self.assertEqual(libtn.merge([('foo', 'is online')]),
+                         ('foo', 'is online'))
+        self.assertEqual(libtn.merge([('foo', 'on'), ('bar', 'off')]),
+                         ('foo, bar', 'foo\non\n\nbar\noff'))
+
+    def test_inform_user(self):
+        settings = libtn.Settings('/tmp/doesn\'t_exist')
+        backend = libtn.MemoryBackend()
+        api = libtn.NotifyApi('', settings, None, False, backend)
+        with unittest.mock.patch('libtn.show_notification') as show:
+            api.inform_user(True, (True, {'game': 'bar'}), 'Foo')
+            self.assertEqual(api.dispatcher.flush(5), True)
+            show.assert_not_called()
+        self.assertEqual(backend.shown, [('foo', 'is online')])
+
+        api.dispatcher.stop(5)
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            api.inform_user(False, (False, None), 'Foo')
+        self.assertIn('queue is stopped', err.getvalue())
+        self.assertIn('1 dropped so far', err.getvalue())
+
 if __name__ == '__main__':
     unittest.main()